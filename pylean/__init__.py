@@ -1,2 +1,3 @@
-from .lean import LeanInstance, LeanException
-from .env import LeanEnv, ProofState, Action
\ No newline at end of file
+from .lean import LeanInstance, LeanException, LeanTimeoutError
+from .env import LeanEnv, ProofState, Action
+from .pool import LeanPool
@@ -1,10 +1,19 @@
+import asyncio
+import hashlib
 import json
-from typing import Optional, Tuple, Union
+import shelve
+import sys
+from typing import List, Optional, Tuple, Union
 
 from .lean import LeanInstance
 
+# lean-gym's tactic state of a finished proof
+_NO_GOALS = "no goals"
+
 
 class ProofState:
+    __slots__ = ("state", "id", "score")
+
     def __init__(
         self,
         state: Optional[str] = 'null',
@@ -16,7 +25,7 @@ class ProofState:
         self.score = score
 
     def __repr__(self) -> str:
-        return repr(self.as_dict())
+        return f"{{'state': {self.state!r}, 'id': {self.id!r}, 'score': {self.score!r}}}"
 
     def as_dict(self) -> dict:
         return {"state": self.state, "id": self.id, "score": self.score}
@@ -26,6 +35,8 @@ class ProofState:
 
 
 class Action:
+    __slots__ = ("state_id", "tactic", "score")
+
     def __init__(
         self,
         state_id: Optional[str] = 'null',
@@ -37,7 +48,10 @@ class Action:
         self.score = score
 
     def __repr__(self) -> str:
-        return repr(self.as_dict())
+        return (
+            f"{{'state_id': {self.state_id!r}, 'tactic': {self.tactic!r}, "
+            f"'score': {self.score!r}}}"
+        )
 
     def as_dict(self) -> dict:
         return {"state_id": self.state_id, "tactic": self.tactic, "score": self.score}
@@ -62,12 +76,39 @@ class LeanEnv(LeanInstance):
 
         timeout : int, default=120
             Timeout for lean commands execution
+
+        cache_size : int, default=4096
+            Maximal number of `(search_id, state_id, tactic)` results
+            kept in memory. Repeated tactic applications are answered
+            from this cache without a round-trip to lean-gym.
+            Set to 0 to disable caching.
+
+        cache_path : Optional[str], default=None
+            If given, failed tactics are additionally stored on disk
+            (see `shelve`) keyed by declaration, goal and tactic,
+            so they are not retried by later runs.
+            Successful results are not persisted: their state ids
+            are only valid within the running lean-gym process.
+
+        use_cache : bool, default=True
+            If `False` --- all tactics are sent to lean-gym, both caches are
+            neither read nor updated. Useful for debugging tactics.
     """
 
-    def __init__(self, *args, decl: Optional[str] = None, **kwargs) -> None:
+    def __init__(
+        self,
+        *args,
+        decl: Optional[str] = None,
+        cache_path: Optional[str] = None,
+        **kwargs,
+    ) -> None:
         super().__init__(*args, **kwargs)
+        self._disk_cache = None
+        if cache_path is not None:
+            self._disk_cache = shelve.open(cache_path)
         self._reset_params()
-        self.decl = decl
+        # The same theorem is usually searched many times
+        self.decl = decl if decl is None else sys.intern(decl)
 
     def step(self, action: Action) -> Tuple[ProofState, float, bool, dict]:
         """
@@ -95,14 +136,71 @@ class LeanEnv(LeanInstance):
                 Dictionary with additional info
                 (error, search_id, tactic_state_id, tactic_state, proof_steps)
         """
-        observation, reward, done = ProofState(), 0, False
+        info = self._run_stmt_cached(action.state_id, action.tactic)
+        observation, reward, done = self._observation(info)
+        return observation, reward, done, info
+
+    def step_batch(
+        self, actions: List[Action]
+    ) -> List[Tuple[ProofState, float, bool, dict]]:
+        """
+        Run several actions at once.
+        Identical actions are sent to lean-gym only once and all the
+        remaining ones are submitted in a single batch.
+
+        Args:
+        -----
+            actions : List[Action]
+                Actions to apply
+
+        Returns:
+        --------
+            List of `(observation, reward, done, info)` tuples as returned
+            by `step`, in the order of `actions`
+        """
+        if len(actions) == 1:
+            # nothing to deduplicate
+            return [self.step(actions[0])]
+        with self._lock:
+            infos = [None] * len(actions)
+            pending = {}
+            for i, action in enumerate(actions):
+                key = (action.state_id, action.tactic)
+                info = self._cache_lookup(*key)
+                if info is not None:
+                    infos[i] = info
+                else:
+                    pending.setdefault(key, []).append(i)
+
+            if pending:
+                results = super().run_batch(
+                    [self.search_id] * len(pending),
+                    [key[0] for key in pending],
+                    [key[1] for key in pending],
+                )
+                for (key, indices), info in zip(pending.items(), results):
+                    self._disk_cache_put(key[0], key[1], info)
+                    for i in indices:
+                        infos[i] = info
+
+        return [self._observation(info) + (info,) for info in infos]
 
-        info = super().run_stmt(self.search_id, action.state_id, action.tactic)
-        if not self.is_error(info):
-            observation = ProofState(info["tactic_state"], info["tactic_state_id"])
-            reward = float(info["tactic_state"] == "no goals")
-            done = info["tactic_state"] == "no goals"
+    async def step_async(
+        self, action: Action
+    ) -> Tuple[ProofState, float, bool, dict]:
+        """
+        Coroutine version of `step`.
+        The lean-gym call runs in the default executor of the event loop,
+        so the loop stays free (e.g. for policy inference) while lean works.
+        Concurrent calls are served by lean-gym one after another.
 
+        Args and returns are the same as in `step`
+        """
+        loop = asyncio.get_event_loop()
+        info = await loop.run_in_executor(
+            None, self._run_stmt_cached, action.state_id, action.tactic
+        )
+        observation, reward, done = self._observation(info)
         return observation, reward, done, info
 
     def reset(
@@ -138,10 +236,13 @@ class LeanEnv(LeanInstance):
             raise ValueError("Declaration name is not provided.")
 
         if options:
-            self._reset_params()
-            self.decl = options["decl"]
+            if options["decl"] != self._init_decl:
+                self._reset_params()
+            self.decl = sys.intern(options["decl"])
 
-        if self.search_id is None or self._init_obs.state_id is None:
+        # Search for the same declaration is already initialized,
+        # no need to ask lean-gym again
+        if self._init_decl is None or self._init_decl != self.decl:
             info = self.init_search(self.decl)
             self._init_info = info
             self._init_obs = ProofState()
@@ -150,6 +251,7 @@ class LeanEnv(LeanInstance):
                     info["tactic_state"], info["tactic_state_id"]
                 )
                 self.search_id = info["search_id"]
+                self._init_decl = self.decl
 
         if return_info:
             return self._init_obs, self._init_info
@@ -160,6 +262,9 @@ class LeanEnv(LeanInstance):
         Perform any necessary cleanup
         """
         self._reset_params()
+        if self._disk_cache is not None:
+            self._disk_cache.close()
+            self._disk_cache = None
         self.kill()
 
     def clear_search(self) -> dict:
@@ -174,6 +279,65 @@ class LeanEnv(LeanInstance):
         self.decl = decl
         return out
 
+    def _run_stmt_cached(self, state_id: str, tactic: str) -> dict:
+        """
+        Run tactic in the current search, reusing the result of an
+        identical previous call if there is one
+        """
+        with self._lock:
+            info = self._cache_lookup(state_id, tactic)
+            if info is None:
+                info = super().run_stmt(self.search_id, state_id, tactic)
+                self._disk_cache_put(state_id, tactic, info)
+            return info
+
+    def _cache_lookup(self, state_id: str, tactic: str) -> Optional[dict]:
+        """
+        Cached result of a tactic: the in-memory cache first, the disk
+        (which hashes the goal text) only on a miss
+        """
+        info = self._cache_get((str(self.search_id), str(state_id), tactic))
+        if info is None:
+            info = self._disk_cache_get(state_id, tactic)
+        return info
+
+    def _disk_cache_get(self, state_id: str, tactic: str) -> Optional[dict]:
+        if not self.use_cache or self._disk_cache is None:
+            return None
+        disk_key = self._disk_key(state_id, tactic)
+        if disk_key is None:
+            return None
+        return self._disk_cache.get(disk_key)
+
+    def _disk_cache_put(self, state_id: str, tactic: str, info: dict) -> None:
+        if info["error"] is None or not self.use_cache or self._disk_cache is None:
+            return
+        disk_key = self._disk_key(state_id, tactic)
+        if disk_key is not None and disk_key not in self._disk_cache:
+            self._disk_cache[disk_key] = info
+
+    def _disk_key(self, state_id: str, tactic: str) -> Optional[str]:
+        """
+        Key of the on-disk cache. Ids are not stable between lean-gym runs,
+        so the key is built from the goal text instead of the state id.
+        """
+        state = self.get_tactic_state(self.search_id, state_id)
+        if state is None:
+            return None
+        return hashlib.blake2b(
+            f"{self.decl}|{state}|{tactic}".encode("utf-8"), digest_size=16
+        ).hexdigest()
+
+    def _observation(self, info: dict) -> Tuple[ProofState, float, bool]:
+        """
+        Build observation, reward and done flag from lean-gym reply
+        """
+        if info["error"] is not None:
+            return ProofState(), 0.0, False
+        tactic_state = info["tactic_state"]
+        done = tactic_state == _NO_GOALS
+        return ProofState(tactic_state, info["tactic_state_id"]), float(done), done
+
     def _reset_params(self) -> None:
         """
         Reset some internal parameters to empty values
@@ -182,3 +346,4 @@ class LeanEnv(LeanInstance):
         self.decl = None
         self._init_obs = ProofState()
         self._init_info = None
+        self._init_decl = None
@@ -1,74 +1,355 @@
+import collections
+import hashlib
 import json
+import os
 import queue
+import selectors
 import subprocess
+import sys
 import threading
-from typing import Optional
+import time
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import orjson
+
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+
+    def _escape(text: str) -> bytes:
+        """
+        UTF-8 contents of a JSON string literal, without the quotes
+        """
+        return orjson.dumps(text)[1:-1]
+
+except ImportError:
+    # C escaper behind json.dumps: only quotes, backslashes and control
+    # characters are escaped, like with ensure_ascii=False
+    from json.encoder import encode_basestring
+
+    def _dumps(obj) -> bytes:
+        text = json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+        return text.encode("utf-8")
+
+    _loads = json.loads
+
+    def _escape(text: str) -> bytes:
+        """
+        UTF-8 contents of a JSON string literal, without the quotes
+        """
+        return encode_basestring(text)[1:-1].encode("utf-8")
+
+
+# Default capacity requested for the pipes to lean (the Linux default
+# is 64 KiB)
+_PIPE_SIZE = 1 << 20
+# Bytes asked from lean's stdout by a single read. Larger buffers are
+# above glibc's mmap threshold (128 KiB) and make every read ~10x slower
+_READ_SIZE = 1 << 16
+# Maximal number of buffers passed to a single writev call
+_IOV_MAX = 1024
+# Tactics shorter than this are interned when stored, the common ones
+# ("simp", "refl", ...) are repeated all over the searches
+_INTERN_MAX_LEN = 64
+
+_INIT_SEARCH = "init_search"
+_RUN_TAC = "run_tac"
+_CLEAR_SEARCH = "clear_search"
+
+# Constant parts of a run_tac command, the most frequent one
+_RUN_TAC_HEAD = b'["' + _RUN_TAC.encode("utf-8") + b'",["'
+_ARG_SEP = b'","'
+_RUN_TAC_TAIL = b'"]]\n'
+
+
+def _command(name: str, *args: str) -> bytes:
+    """
+    Encode a lean-gym command as a UTF-8 JSON line.
+    Arguments are properly escaped, so tactics may contain quotes
+    and backslashes.
+    """
+    return _dumps([name, [str(arg) for arg in args]]) + b"\n"
+
+
+def _run_tac_command(search_id: str, state_id: str, tactic: str) -> bytes:
+    """
+    Same as `_command(_RUN_TAC, search_id, state_id, tactic)`, but only the
+    arguments are encoded
+    """
+    return b"".join(
+        (
+            _RUN_TAC_HEAD,
+            _escape(search_id),
+            _ARG_SEP,
+            _escape(state_id),
+            _ARG_SEP,
+            _escape(tactic),
+            _RUN_TAC_TAIL,
+        )
+    )
+
+
+def _set_pipe_size(fd: int, size: int) -> None:
+    """
+    Try to enlarge pipe capacity, so that lean can write long replies and we
+    can submit big batches without blocking each other.
+    Only supported on Linux, elsewhere it does nothing.
+    """
+    if fcntl is None:
+        return
+    try:
+        fcntl.fcntl(fd, getattr(fcntl, "F_SETPIPE_SZ", 1031), size)
+    except OSError:
+        # Not Linux, or size is above /proc/sys/fs/pipe-max-size
+        pass
 
 
 class LeanException(Exception):
     pass
 
 
-class LeanInstance(threading.Thread):
-    """ """
+class LeanTimeoutError(LeanException, queue.Empty):
+    """
+    Lean did not answer in time. Also a `queue.Empty` for code written
+    against the old reader thread.
+    """
+
+
+class _StateNode:
+    """
+    State seen in a search: its goals and the tactic it was first reached by
+    """
+
+    __slots__ = ("tactic_state", "prev_state_id", "tactic")
 
     def __init__(
-        self, lean_gym_path: str, timeout: int = 300, verbose: int = 0
+        self,
+        tactic_state: str,
+        prev_state_id: Optional[str] = None,
+        tactic: Optional[str] = None,
     ) -> None:
+        self.tactic_state = tactic_state
+        self.prev_state_id = prev_state_id
+        self.tactic = tactic
+
+
+class LeanInstance:
+    """
+    Connection to a lean-gym REPL process.
+    POSIX only (Linux, macOS): lean's pipes are used non-blocking and
+    waited on with `selectors`, which Windows does not support for pipes.
+
+    Args:
+    -----
+        lean_gym_path : path-like,
+            Path to the lean-gym directory
+
+        timeout : int, default=300
+            Timeout for lean commands execution
+
+        verbose : int, default=0
+            If non-zero, lean's diagnostics (stderr) are shown
+
+        cache_size : int, default=4096
+            Maximal number of `(search_id, state_id, tactic)` results
+            kept in memory. Set to 0 to disable caching.
+
+        use_cache : bool, default=True
+            If `False` --- all tactics are sent to lean-gym
+
+        cache_by_state : bool, default=False
+            Also reuse results for states with the same goals within a search
+
+        pipe_size : Optional[int], default=1048576
+            Capacity requested for the pipes to lean (Linux only).
+            Unprivileged processes can not exceed /proc/sys/fs/pipe-max-size
+            (1 MiB by default), larger values are ignored.
+            `None` or 0 keeps the kernel default.
+
+        max_live_searches : Optional[int], default=None
+            If given, the oldest searches are cleared (as by `clear_search`)
+            once more of them are initialized, so that long sweeps that
+            forget to clear searches do not grow lean's and our memory
+            without bound. Searches of the current `init_search_batch`
+            are never cleared, so larger batches are rejected.
+    """
+
+    def __init__(
+        self,
+        lean_gym_path: str,
+        timeout: int = 300,
+        verbose: int = 0,
+        cache_size: int = 4096,
+        use_cache: bool = True,
+        cache_by_state: bool = False,
+        pipe_size: Optional[int] = _PIPE_SIZE,
+        max_live_searches: Optional[int] = None,
+    ) -> None:
+        if os.name != "posix":
+            raise LeanException(
+                "LeanInstance requires a POSIX system (Linux, macOS), "
+                "on Windows run it under WSL"
+            )
         self.lean_gym_path = lean_gym_path
         self.command = ["lean", "--run", "src/repl.lean"]
         self.timeout = timeout
         self.verbose = verbose
-        self.__sema = threading.Semaphore(value=0)
-        threading.Thread.__init__(self, daemon=True)
+        if pipe_size is not None and pipe_size < 0:
+            raise ValueError(f"pipe_size must be non-negative, got {pipe_size}")
+        self.pipe_size = pipe_size
+        self.max_live_searches = max_live_searches
+        # (search_id, state_id, tactic) -> lean-gym reply, least recently
+        # used first
+        self.cache_size = cache_size
+        self.use_cache = use_cache
+        self._result_cache = OrderedDict()
+        # Also reuse results for states with the same goal text
+        # (reached by a different path) within the same search
+        self.cache_by_state = cache_by_state
+        # search_id -> {state_id -> _StateNode}
+        self._states = {}
+        # Same goals show up in many branches, keep a single copy of them
+        self._state_intern = {}
+        # interned goals -> number of state records using them, so that
+        # clearing a search only touches its own goals
+        self._state_refs = {}
+        # tactic state string -> its digest used in `cache_by_state` keys
+        self._state_digests = {}
+        # search_id -> [failed, total] number of tactics run by lean
+        self._tactic_counts = {}
+        # Commands and replies are matched by order only, so a request
+        # and the read of its reply must not interleave with another one
+        self._lock = threading.RLock()
         # Open a process to lean, with streams for communicating with
         # it.
         self._proc = subprocess.Popen(
             self.command,
             cwd=self.lean_gym_path,
+            # Pipes are used through os.read/os.writev on their fds,
+            # Python level buffers would only hide data from select()
+            bufsize=0,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            # Nobody reads lean's diagnostics from a pipe, and a full pipe
+            # would block lean forever. Show them only in verbose mode.
+            stderr=None if self.verbose else subprocess.DEVNULL,
         )
         self._fout = self._proc.stdout
         self._fin = self._proc.stdin
+        # Both ends are non-blocking: stdout is read before waiting on it,
+        # an empty pipe just means there is nothing to take yet
+        os.set_blocking(self._fin.fileno(), False)
+        os.set_blocking(self._fout.fileno(), False)
+        if self.pipe_size:
+            for fd in (self._fin.fileno(), self._fout.fileno()):
+                _set_pipe_size(fd, self.pipe_size)
+        # Registered once, instead of passing fd lists to select() on
+        # every wait (and hitting its FD_SETSIZE limit in big pools).
+        # The second one also waits for room in stdin while writing.
+        self._read_selector = selectors.DefaultSelector()
+        self._read_selector.register(self._fout, selectors.EVENT_READ)
+        self._write_selector = selectors.DefaultSelector()
+        self._write_selector.register(self._fout, selectors.EVENT_READ)
+        self._write_selector.register(self._fin, selectors.EVENT_WRITE)
 
         # Set up the message queue, which we'll populate with the
-        # messages from lean-gym.
-        self.message_queue = queue.Queue()
+        # messages from lean-gym. Replies are read by the caller itself
+        # when it waits for them, `_read_buffer` keeps an incomplete line.
+        self.message_queue = collections.deque()
+        self._read_buffer = bytearray()
+        # Replies to commands sent so far that nobody has read yet, and
+        # how many of them belong to commands abandoned after a timeout
+        self._n_unanswered = 0
+        self._n_stale = 0
+        # Last command sent, as bytes; decoded only for error messages
         self._last_flash_cmd = None
 
-        # Start the message queue thread
-        self.start()
-
     def init_search(self, decl: str) -> dict:
         """
         Initialize lean for the given declaration of the statement
         """
-        self._send_flush(f'["init_search", ["{decl}", ""]]\n')
-        msg = [self._get_message(self.timeout)]
-        while "warning:" in msg[-1]:
-            msg.append(self._get_message(self.timeout))
-        result = json.loads(msg[-1])
-
-        if not self.is_error(result):
-            search_id = result["search_id"]
-            tactic_state_id = result["tactic_state_id"]
+        with self._lock:
+            self._send_flush(_command(_INIT_SEARCH, decl, ""))
+            result = self.get_result()
+            if result["error"] is None:
+                self._record_state(
+                    result["search_id"], result["tactic_state_id"], result
+                )
+                self._evict_searches()
+            return result
 
-        return result
+    def init_search_batch(self, decls: List[str]) -> List[dict]:
+        """
+        Initialize lean for several declarations at once.
+        All commands are sent in one go and the replies are read back
+        in the same order, so the lean process never waits for us
+        between the searches.
+        """
+        if self.max_live_searches is not None and len(decls) > self.max_live_searches:
+            raise ValueError(
+                f"Can not initialize {len(decls)} searches at once "
+                f"with max_live_searches={self.max_live_searches}"
+            )
+        with self._lock:
+            self._send_flush_many([_command(_INIT_SEARCH, decl, "") for decl in decls])
+            results = [self.get_result() for _ in decls]
+            for result in results:
+                if result["error"] is None:
+                    self._record_state(
+                        result["search_id"], result["tactic_state_id"], result
+                    )
+            self._evict_searches()
+            return results
 
     def run_stmt(self, search_id: str, state_id: str, tactic: str) -> dict:
         """
         Run given tactic for a given search at given state
         """
-        cmd = f'["run_tac",["{search_id}","{state_id}","{tactic}"]]\n'
-        self._send_flush(cmd)
-        results = self.get_result()
+        # lean-gym ids are decimal strings, accept ints as well
+        key = (str(search_id), str(state_id), tactic)
+        with self._lock:
+            results = self._cache_get(key)
+            if results is None:
+                self._send_flush(_run_tac_command(*key))
+                results = self.get_result()
+                self._cache_put(key, results)
+        return results
+
+    def run_batch(
+        self, search_ids: List[str], state_ids: List[str], tactics: List[str]
+    ) -> List[dict]:
+        """
+        Run several tactics at once.
+        All commands that are not cached are sent in one go, results are
+        returned in the order of the inputs.
+        """
+        if len(search_ids) == 1:
+            return [self.run_stmt(search_ids[0], state_ids[0], tactics[0])]
+        keys = [
+            (str(search_id), str(state_id), tactic)
+            for search_id, state_id, tactic in zip(search_ids, state_ids, tactics)
+        ]
+        with self._lock:
+            results = [self._cache_get(key) for key in keys]
+            missing = [i for i, result in enumerate(results) if result is None]
+            if missing:
+                self._send_flush_many([_run_tac_command(*keys[i]) for i in missing])
+                for i in missing:
+                    results[i] = self.get_result()
+                    self._cache_put(keys[i], results[i])
         return results
 
     def clear_search(self, search_id: str) -> dict:
-        self._send_flush(f'["clear_search",["{search_id}"]]\n')
-        result = self.get_result(timeout=1)
+        with self._lock:
+            self._send_flush(_command(_CLEAR_SEARCH, search_id))
+            result = self.get_result(timeout=1)
+            self._drop_cached_searches([str(search_id)])
 
         if self.is_error(result):
             print(bcolors.WARNING + result['error'] + bcolors.ENDC)
@@ -76,43 +357,305 @@ class LeanInstance(threading.Thread):
 
         return result
 
-    def _send_flush(self, cmd: str) -> None:
+    def clear_search_batch(self, search_ids: List[str]) -> List[dict]:
+        """
+        Clear several searches at once.
+        All commands are sent in one go; if any of them fails the error
+        is raised after all replies have been read.
+        """
+        with self._lock:
+            self._send_flush_many(
+                [_command(_CLEAR_SEARCH, search_id) for search_id in search_ids]
+            )
+            results = [self.get_result(timeout=1) for _ in search_ids]
+            self._drop_cached_searches([str(search_id) for search_id in search_ids])
+
+        for result in results:
+            if self.is_error(result):
+                print(bcolors.WARNING + result['error'] + bcolors.ENDC)
+                raise RuntimeError(result['error'])
+
+        return results
+
+    def _evict_searches(self) -> None:
+        """
+        Clear the oldest searches above `max_live_searches`.
+        Failures are only reported: the searches just initialized are
+        fine, and the ones left uncleared are tried again next time.
+        """
+        if self.max_live_searches is None:
+            return
+        # Known searches are kept in the order of their initialization
+        n_excess = len(self._states) - self.max_live_searches
+        if n_excess <= 0:
+            return
+        try:
+            self.clear_search_batch(list(self._states)[:n_excess])
+        except (LeanException, RuntimeError) as e:
+            print(bcolors.WARNING + f"Failed to clear old searches: {e}" + bcolors.ENDC)
+
+    def _cache_get(self, key: tuple) -> Optional[dict]:
+        if not self.use_cache:
+            return None
+        result = self._result_cache.get(key)
+        if result is not None:
+            self._result_cache.move_to_end(key)
+        elif self.cache_by_state:
+            state_key = self._state_key(key)
+            if state_key is not None:
+                result = self._result_cache.get(state_key)
+                if result is not None:
+                    self._result_cache.move_to_end(state_key)
+        return result
+
+    def _cache_put(self, key: tuple, result: dict) -> None:
+        search_id, state_id, tactic = key
+        if len(tactic) < _INTERN_MAX_LEN:
+            tactic = sys.intern(tactic)
+            key = (search_id, state_id, tactic)
+        failed = result["error"] is not None
+        counts = self._tactic_counts.setdefault(search_id, [0, 0])
+        counts[0] += failed
+        counts[1] += 1
+        if not failed:
+            self._record_state(
+                search_id, result["tactic_state_id"], result, state_id, tactic
+            )
+        # Errors are not kept: e.g. `unknown_id` for a state that does not
+        # exist yet becomes wrong once the state is reached. Failures are
+        # remembered by LeanEnv's goal-keyed disk cache instead.
+        if not failed and self.use_cache and self.cache_size > 0:
+            self._cache_store(key, result)
+            if self.cache_by_state:
+                state_key = self._state_key(key)
+                if state_key is not None:
+                    self._cache_store(state_key, result)
+
+    def _cache_store(self, key: tuple, result: dict) -> None:
+        self._result_cache[key] = result
+        if len(self._result_cache) > self.cache_size:
+            self._result_cache.popitem(last=False)
+
+    def _state_key(self, key: tuple) -> Optional[tuple]:
+        """
+        Cache key with the state id replaced by a digest of the state text
+        """
+        search_id, state_id, tactic = key
+        node = self._state_node(search_id, state_id)
+        if node is None:
+            return None
+        state = node.tactic_state
+        digest = self._state_digests.get(state)
+        if digest is None:
+            digest = hashlib.blake2b(state.encode("utf-8"), digest_size=16).digest()
+            self._state_digests[state] = digest
+        return (search_id, digest, tactic)
+
+    def get_proof_branch(
+        self, search_id: str, state_id: str
+    ) -> Tuple[List[str], List[str]]:
+        """
+        Tactics leading from the initial state of the search to the given one
+        and the ids of the states they produce
+        """
+        states = self._states.get(str(search_id), {})
+        state_id = str(state_id)
+        tactics, ids = [], []
+        node = states.get(state_id)
+        while node is not None and node.prev_state_id is not None:
+            tactics.append(node.tactic)
+            ids.append(state_id)
+            state_id = node.prev_state_id
+            node = states.get(state_id)
+        return tactics[::-1], ids[::-1]
+
+    def get_tactic_counts(self, search_id: str) -> Tuple[int, int]:
+        """
+        Number of failed and total tactics lean has run in the given search
+        (cached results are not counted)
+        """
+        n_failed, n_total = self._tactic_counts.get(str(search_id), (0, 0))
+        return n_failed, n_total
+
+    def get_tactic_state(self, search_id: str, state_id: str) -> Optional[str]:
+        """
+        Goals of a state seen in the given search, `None` if it is unknown
+        """
+        node = self._state_node(str(search_id), str(state_id))
+        if node is None:
+            return None
+        return node.tactic_state
+
+    def _state_node(self, search_id: str, state_id: str) -> Optional[_StateNode]:
+        # Called for every step, so no throwaway `{}` default for
+        # unknown searches
+        states = self._states.get(search_id)
+        if states is None:
+            return None
+        return states.get(state_id)
+
+    def _record_state(
+        self,
+        search_id: str,
+        state_id: str,
+        result: dict,
+        prev_state_id: Optional[str] = None,
+        tactic: Optional[str] = None,
+    ) -> None:
+        """
+        Remember goals of a successful reply and the first way to reach them
+        """
+        states = self._states.setdefault(search_id, {})
+        node = states.get(state_id)
+        if node is None:
+            state = result["tactic_state"]
+            state = self._state_intern.setdefault(state, state)
+            self._state_refs[state] = self._state_refs.get(state, 0) + 1
+            node = states[state_id] = _StateNode(state, prev_state_id, tactic)
+        result["tactic_state"] = node.tactic_state
+
+    def _drop_cached_searches(self, search_ids: List[str]) -> None:
+        """
+        Remove cached results and known states of the given searches
+        """
+        search_ids = set(search_ids)
+        for key in [k for k in self._result_cache if k[0] in search_ids]:
+            del self._result_cache[key]
+        refs = self._state_refs
+        for search_id in search_ids:
+            self._tactic_counts.pop(search_id, None)
+            for node in self._states.pop(search_id, {}).values():
+                state = node.tactic_state
+                refs[state] -= 1
+                if not refs[state]:
+                    del refs[state]
+                    del self._state_intern[state]
+                    self._state_digests.pop(state, None)
+
+    def _send_flush(self, cmd: bytes) -> None:
+        self._send_flush_many([cmd])
+
+    def _send_flush_many(self, cmds: List[bytes]) -> None:
         assert self._fin
-        self._last_flash_cmd = cmd
+        self._last_flash_cmd = cmds[-1] if cmds else None
+        # Requests always read all their replies unless they fail, so
+        # whatever is still unanswered now will never be waited for
+        self._n_stale = self._n_unanswered
+        self._n_unanswered += len(cmds)
+        self._write(cmds)
+
+    def _last_cmd_text(self) -> Optional[str]:
+        if self._last_flash_cmd is None:
+            return None
+        return self._last_flash_cmd.decode("utf-8").rstrip("\n")
+
+    def _write(self, chunks: List[bytes]) -> None:
+        """
+        Write data to lean's stdin, all chunks with a single writev call
+        when the pipe has room for them.
+        Lean answers while we are still writing a large batch, so its
+        replies are drained whenever stdin is full. Otherwise both
+        pipes fill up and both processes wait for each other forever.
+        """
+        if self._fin.closed:
+            raise LeanException("Lean process is killed")
+        fd = self._fin.fileno()
+        views = [memoryview(chunk) for chunk in chunks if chunk]
+        first = 0
         try:
-            self._fin.write(cmd.encode("utf-8"))
-            self._fin.flush()
+            while True:
+                try:
+                    written = os.writev(fd, views[first : first + _IOV_MAX])
+                except BlockingIOError:
+                    written = 0
+                # Skip what has been written, the last chunk may be partial
+                while first < len(views) and written >= len(views[first]):
+                    written -= len(views[first])
+                    first += 1
+                if first == len(views):
+                    return
+                views[first] = views[first][written:]
+                for key, _ in self._write_selector.select():
+                    if key.fileobj is self._fout:
+                        self._read_available()
         except BrokenPipeError:
-            raise LeanException(f"Lean process unexpectedly quit. Last cmd: {cmd}")
-
-    def run(self) -> None:
-        assert self._fout
-        while not self.__sema.acquire(False):
-            try:
-                line = self._fout.readline().decode("utf-8")
-            except ValueError:
-                continue
-            if line.strip() == "":
-                break
-            self.message_queue.put(line)
+            raise LeanException(
+                f"Lean process unexpectedly quit. Last cmd: {self._last_cmd_text()}"
+            )
+
+    def _read_available(self) -> bool:
+        """
+        Read whatever lean has written so far and put complete lines to
+        the message queue. One syscall may bring several messages.
+        Returns `False` if there was nothing to read.
+        """
+        try:
+            chunk = os.read(self._fout.fileno(), _READ_SIZE)
+        except BlockingIOError:
+            return False
+        if not chunk:
+            raise LeanException(
+                f"Lean process unexpectedly quit. Last cmd: {self._last_cmd_text()}"
+            )
+        buffer = self._read_buffer
+        if buffer:
+            buffer += chunk
+            if chunk.find(b"\n") < 0:
+                return True
+            chunk = bytes(buffer)
+            buffer.clear()
+        # bytes.split scans for newlines in C. Usually a read ends with
+        # a complete reply, then nothing is copied and the tail is empty
+        lines = chunk.split(b"\n")
+        buffer += lines.pop()
+        # One extend per read instead of an append per line
+        self.message_queue.extend(filter(bytes.strip, lines))
+        return True
 
     def kill(self) -> None:
         assert self._proc.stdout
+        # Closing stdin lets lean exit on its own, the signals make sure it does
+        for stream in (self._fin, self._fout):
+            stream.close()
+        self._read_selector.close()
+        self._write_selector.close()
         self._proc.terminate()
-        self._proc.kill()
-        self.__sema.release()
+        try:
+            self._proc.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
 
-    def get_result(self, timeout: Optional[float] = None) -> str:
-        timeout = timeout if timeout else self.timeout
-        return json.loads(self._get_message(timeout=timeout))
+    def get_result(self, timeout: Optional[float] = None) -> dict:
+        timeout = self.timeout if timeout is None else timeout
+        while True:
+            msg = self._get_message(timeout=timeout)
+            # Anything that is not a JSON object is lean's diagnostic output,
+            # e.g. (possibly multi-line) warnings printed on init_search
+            if not msg.startswith(b"{"):
+                continue
+            self._n_unanswered -= 1
+            # Late answer to a timed out command, lean replies in order
+            if self._n_stale > 0:
+                self._n_stale -= 1
+                continue
+            return _loads(msg)
 
-    def _get_message(self, timeout: Optional[float] = None) -> str:
-        timeout = timeout if timeout else self.timeout
-        try:
-            msg = self.message_queue.get(timeout=timeout)
-            return msg
-        except queue.Empty:
-            raise queue.Empty(f"Command time out. Last cmd: {self._last_flash_cmd}, timeout={timeout}")
+    def _get_message(self, timeout: Optional[float] = None) -> bytes:
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while not self.message_queue:
+            # Replies of a batch usually are already there, take them
+            # without waiting; timeout=0 also checks once this way
+            if self._read_available():
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise LeanTimeoutError(
+                    f"Command time out. Last cmd: {self._last_cmd_text()}, timeout={timeout}"
+                )
+            self._read_selector.select(remaining)
+        return self.message_queue.popleft()
 
     def is_error(self, result):
         return result['error'] is not None
@@ -128,47 +671,3 @@ class bcolors:
     ENDC = '\033[0m'
     BOLD = '\033[1m'
     UNDERLINE = '\033[4m'
-
-
-# def validate_proof_search(lean, search_id):
-#     from copy import deepcopy
-
-#     assert len(lean.proof_searchs) == 1
-#     proof_search = deepcopy(lean.proof_searchs[search_id])
-#     for state_id, state in proof_search['states'].items():
-#         for tac, next_state_id in state['tactic_to_next_id'].items():
-#             res = lean.run_stmt(search_id, state_id, tac)
-#             if (res['tactic_state'] != proof_search['states'][next_state_id]['state']
-#                 and not (res['tactic_state'] is not None
-#                          and '_fresh_' in res['tactic_state']
-#                          and '_fresh_' in proof_search['states'][next_state_id]['state'])
-#             ):
-#                 print(tac)
-#                 print(res)
-#                 tactics, ids = get_proof_branch(proof_search, next_state_id)
-#                 lean2 = LeanInstance(lean_gym_path=lean.lean_gym_path)
-#                 lean2.init_search(lean.decl)
-#                 i = 0
-#                 res2 = []
-#                 for t in tactics:
-#                     res2.append(lean2.run_stmt(0, i, t))
-#                     if res2[-1]['tactic_state_id'] is not None:
-#                         i = int(res2[-1]['tactic_state_id'])
-#                     else:
-#                         breakpoint()
-#                         print('sapog')
-#                 breakpoint()
-
-
-# def get_proof_branch(proof_search, last_state_id):
-
-#     tactics = []
-#     ids = []
-#     while proof_search['states'][last_state_id]['id_prev']:
-#         id_prev = proof_search['states'][last_state_id]['id_prev'][0]
-#         tac, i = zip(*[(tac, i) for tac, i in proof_search['states'][id_prev]['tactic_to_next_id'].items() if i == last_state_id])
-#         tactics.append(tac[0])
-#         ids.append(i[0])
-#         last_state_id = id_prev
-
-#     return tactics[::-1], ids[::-1]
@@ -0,0 +1,207 @@
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from .lean import LeanInstance, bcolors
+
+
+class LeanPool:
+    """
+    Pool of lean-gym processes.
+    Every search lives in exactly one process; new searches go to the
+    process with the fewest live searches. Batches touching searches of
+    different processes are executed by these processes in parallel.
+
+    Args:
+    -----
+        lean_gym_path : path-like,
+            Path to the lean-gym directory
+
+        n_workers : int, default=2
+            Number of lean-gym processes. Each of them loads its own copy
+            of the library (several GB with mathlib), so do not simply
+            start one per CPU
+
+        **kwargs
+            Passed to every `LeanInstance`, except `max_live_searches`:
+            processes must not clear searches the pool still maps
+    """
+
+    def __init__(
+        self, lean_gym_path: str, n_workers: int = 2, **kwargs
+    ) -> None:
+        if kwargs.get("max_live_searches") is not None:
+            raise TypeError("LeanPool does not support max_live_searches")
+        if n_workers < 1:
+            raise ValueError(f"n_workers must be positive, got {n_workers}")
+        self.workers = [
+            LeanInstance(lean_gym_path, **kwargs) for _ in range(n_workers)
+        ]
+        # lean-gym numbers searches per process, so the pool gives out its
+        # own ids: pool search_id -> (worker index, worker search_id)
+        self._searches: Dict[str, Tuple[int, str]] = {}
+        self._n_searches = [0] * n_workers
+        self._search_counter = itertools.count()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=n_workers)
+
+    def init_search(self, decl: str) -> dict:
+        """
+        Initialize lean for the given declaration of the statement
+        in the least loaded process
+        """
+        with self._lock:
+            worker_idx = min(
+                range(len(self.workers)), key=self._n_searches.__getitem__
+            )
+            self._n_searches[worker_idx] += 1
+        try:
+            result = self.workers[worker_idx].init_search(decl)
+        except Exception:
+            with self._lock:
+                self._n_searches[worker_idx] -= 1
+            raise
+
+        with self._lock:
+            if result["error"] is not None:
+                self._n_searches[worker_idx] -= 1
+                return result
+            search_id = str(next(self._search_counter))
+            self._searches[search_id] = (worker_idx, result["search_id"])
+        return dict(result, search_id=search_id)
+
+    def init_search_batch(self, decls: List[str]) -> List[dict]:
+        """
+        Initialize several searches at once.
+        Declarations are spread over the least loaded processes, which
+        initialize them in parallel. Results are returned in the order
+        of the inputs.
+        """
+        groups: Dict[int, List[int]] = {}
+        with self._lock:
+            for i in range(len(decls)):
+                worker_idx = min(
+                    range(len(self.workers)), key=self._n_searches.__getitem__
+                )
+                self._n_searches[worker_idx] += 1
+                groups.setdefault(worker_idx, []).append(i)
+
+        futures = [
+            (
+                worker_idx,
+                indices,
+                self._executor.submit(
+                    self.workers[worker_idx].init_search_batch,
+                    [decls[i] for i in indices],
+                ),
+            )
+            for worker_idx, indices in groups.items()
+        ]
+        outcomes = []
+        error = None
+        for worker_idx, indices, future in futures:
+            try:
+                outcomes.append((worker_idx, indices, future.result()))
+            except Exception as e:
+                error = error or e
+                with self._lock:
+                    self._n_searches[worker_idx] -= len(indices)
+
+        if error is not None:
+            # The caller never sees the ids of the other groups, so their
+            # searches are cleared instead of being left unreachable
+            for worker_idx, indices, group_results in outcomes:
+                worker_search_ids = [
+                    result["search_id"]
+                    for result in group_results
+                    if result["error"] is None
+                ]
+                try:
+                    if worker_search_ids:
+                        self.workers[worker_idx].clear_search_batch(worker_search_ids)
+                except Exception as e:
+                    print(
+                        bcolors.WARNING
+                        + f"Failed to clear searches of a failed batch: {e}"
+                        + bcolors.ENDC
+                    )
+                with self._lock:
+                    self._n_searches[worker_idx] -= len(indices)
+            raise error
+
+        results = [None] * len(decls)
+        with self._lock:
+            for worker_idx, indices, group_results in outcomes:
+                for i, result in zip(indices, group_results):
+                    if result["error"] is not None:
+                        self._n_searches[worker_idx] -= 1
+                        results[i] = result
+                        continue
+                    search_id = str(next(self._search_counter))
+                    self._searches[search_id] = (worker_idx, result["search_id"])
+                    results[i] = dict(result, search_id=search_id)
+        return results
+
+    def run_stmt(self, search_id: str, state_id: str, tactic: str) -> dict:
+        """
+        Run given tactic for a given search at given state
+        """
+        worker_idx, worker_search_id = self._searches[str(search_id)]
+        result = self.workers[worker_idx].run_stmt(worker_search_id, state_id, tactic)
+        return self._to_pool_ids(search_id, result)
+
+    def run_batch(
+        self, search_ids: List[str], state_ids: List[str], tactics: List[str]
+    ) -> List[dict]:
+        """
+        Run several tactics at once.
+        Inputs are grouped by process, the groups run in parallel.
+        Results are returned in the order of the inputs.
+        """
+        if len(search_ids) == 1:
+            # nothing to run in parallel, skip the executor round-trip
+            return [self.run_stmt(search_ids[0], state_ids[0], tactics[0])]
+        # resolve every pool id once, replies are matched back by position
+        located = [self._searches[str(search_id)] for search_id in search_ids]
+        groups: Dict[int, List[int]] = {}
+        for i, (worker_idx, _) in enumerate(located):
+            groups.setdefault(worker_idx, []).append(i)
+
+        def run_group(worker_idx: int, indices: List[int]) -> List[dict]:
+            return self.workers[worker_idx].run_batch(
+                [located[i][1] for i in indices],
+                [state_ids[i] for i in indices],
+                [tactics[i] for i in indices],
+            )
+
+        futures = [
+            (indices, self._executor.submit(run_group, worker_idx, indices))
+            for worker_idx, indices in groups.items()
+        ]
+        results = [None] * len(search_ids)
+        for indices, future in futures:
+            for i, result in zip(indices, future.result()):
+                results[i] = self._to_pool_ids(search_ids[i], result)
+        return results
+
+    def clear_search(self, search_id: str) -> dict:
+        """
+        Clear proof search state
+        """
+        worker_idx, worker_search_id = self._searches[str(search_id)]
+        result = self.workers[worker_idx].clear_search(worker_search_id)
+        with self._lock:
+            del self._searches[str(search_id)]
+            self._n_searches[worker_idx] -= 1
+        return result
+
+    def kill(self) -> None:
+        for worker in self.workers:
+            worker.kill()
+        self._executor.shutdown(wait=False)
+
+    def _to_pool_ids(self, search_id: str, result: dict) -> dict:
+        if result["search_id"] is None:
+            return result
+        return dict(result, search_id=str(search_id))
@@ -7,5 +7,7 @@ setup(
     author="",
     description="Python wrapper for lean-gym",
     packages=["pylean"],
+    extras_require={"orjson": ["orjson"]},
     python_requires=">=3.6",
+    classifiers=["Operating System :: POSIX"],
 )
@@ -0,0 +1,7 @@
+import os
+
+# Tests talk to a stub of lean-gym's REPL, see tests/bin/lean
+LEAN_GYM_PATH = os.path.dirname(os.path.abspath(__file__))
+os.environ["PATH"] = (
+    os.path.join(LEAN_GYM_PATH, "bin") + os.pathsep + os.environ.get("PATH", "")
+)
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+from pylean import Action, LeanEnv
+
+from . import LEAN_GYM_PATH
+
+
+class LeanEnvTest(unittest.TestCase):
+    def make_env(self, **kwargs):
+        env = LeanEnv(LEAN_GYM_PATH, decl="foo", timeout=10, **kwargs)
+        self.addCleanup(env.close)
+        return env
+
+    def test_step_async(self):
+        env = self.make_env()
+        env.reset()
+
+        async def steps():
+            return await asyncio.gather(
+                env.step_async(Action("0", "a")), env.step_async(Action("0", "b"))
+            )
+
+        loop = asyncio.new_event_loop()
+        try:
+            outputs = loop.run_until_complete(steps())
+        finally:
+            loop.close()
+        self.assertEqual(
+            sorted(state.state for state, _, _, _ in outputs),
+            ["⊢ foo | a", "⊢ foo | b"],
+        )
+
+    def test_step_batch_dedup(self):
+        env = self.make_env()
+        env.reset()
+        actions = [Action("0", tactic) for tactic in ("a", "b", "a", "fail")]
+        outputs = env.step_batch(actions)
+        self.assertEqual(
+            [state.state for state, _, _, _ in outputs],
+            ["⊢ foo | a", "⊢ foo | b", "⊢ foo | a", "null"],
+        )
+        self.assertIs(outputs[0][3], outputs[2][3])
+        self.assertEqual(env.get_tactic_counts(env.search_id), (1, 3))
+        self.assertEqual(len(env.step_batch([Action("0", "c")])), 1)
+
+    def test_proof(self):
+        env = self.make_env()
+        state = env.reset()
+        self.assertEqual((state.state, state.id), ("⊢ foo", "0"))
+        state, reward, done, info = env.step(Action(state.id, "intro"))
+        self.assertEqual((state.state, reward, done), ("⊢ foo | intro", 0.0, False))
+        state, reward, done, info = env.step(Action(state.id, "done"))
+        self.assertEqual((state.state, reward, done), ("no goals", 1.0, True))
+
+    def test_reset_same_decl(self):
+        env = self.make_env()
+        env.reset()
+        search_id = env.search_id
+        state, info = env.reset(options={"decl": "foo"}, return_info=True)
+        self.assertEqual(env.search_id, search_id)
+        self.assertEqual(state.state, "⊢ foo")
+        env.reset(options={"decl": "bar"})
+        self.assertNotEqual(env.search_id, search_id)
+
+    def test_failed_step(self):
+        env = self.make_env()
+        env.reset()
+        state, reward, done, info = env.step(Action("0", "fail"))
+        self.assertEqual((state.id, reward, done), ("null", 0.0, False))
+        self.assertIsNotNone(info["error"])
+
+    def test_failures_on_disk(self):
+        path = os.path.join(tempfile.mkdtemp(), "cache")
+        env = self.make_env(cache_path=path)
+        env.reset()
+        env.step(Action("0", "fail"))
+        env.step(Action("0", "intro"))
+        env.close()
+
+        env = self.make_env(cache_path=path)
+        env.reset()
+        state, reward, done, info = env.step(Action("0", "fail"))
+        self.assertIsNotNone(info["error"])
+        # Only the failure is answered from disk
+        self.assertEqual(env.get_tactic_counts(env.search_id), (0, 0))
+        env.step(Action("0", "intro"))
+        self.assertEqual(env.get_tactic_counts(env.search_id), (0, 1))
+
+    def test_memory_cache_before_disk(self):
+        env = self.make_env(cache_path=os.path.join(tempfile.mkdtemp(), "cache"))
+        env.reset()
+        with unittest.mock.patch.object(
+            env, "_disk_cache_get", wraps=env._disk_cache_get
+        ) as disk_get:
+            for _ in range(5):
+                env.step(Action("0", "intro"))
+            env.step_batch([Action("0", "intro"), Action("0", "simp")])
+        # Only the first "intro" and "simp" missed the memory cache
+        self.assertEqual(disk_get.call_count, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
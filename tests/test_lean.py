@@ -0,0 +1,210 @@
+import unittest
+
+from pylean import LeanException, LeanInstance, LeanTimeoutError
+
+from . import LEAN_GYM_PATH
+
+
+class LeanInstanceTest(unittest.TestCase):
+    def make_lean(self, **kwargs):
+        kwargs.setdefault("timeout", 10)
+        lean = LeanInstance(LEAN_GYM_PATH, **kwargs)
+        self.addCleanup(lean.kill)
+        return lean
+
+    def test_cache_is_lru(self):
+        lean = self.make_lean(cache_size=2)
+        search_id = lean.init_search("foo")["search_id"]
+        a = lean.run_stmt(search_id, "0", "a")
+        lean.run_stmt(search_id, "0", "b")
+        lean.run_stmt(search_id, "0", "a")
+        lean.run_stmt(search_id, "0", "c")
+        # "b" was the least recently used one
+        self.assertIs(lean.run_stmt(search_id, "0", "a"), a)
+        self.assertEqual(lean.get_tactic_counts(search_id), (0, 3))
+        lean.run_stmt(search_id, "0", "b")
+        self.assertEqual(lean.get_tactic_counts(search_id), (0, 4))
+
+    def test_init_search_batch(self):
+        lean = self.make_lean()
+        results = lean.init_search_batch(["a", "b", "c"])
+        self.assertEqual(
+            [result["tactic_state"] for result in results], ["⊢ a", "⊢ b", "⊢ c"]
+        )
+        for result in results:
+            self.assertEqual(
+                lean.get_tactic_state(result["search_id"], "0"),
+                result["tactic_state"],
+            )
+
+    def test_clear_search(self):
+        lean = self.make_lean()
+        search_ids = [r["search_id"] for r in lean.init_search_batch(["a", "b", "c"])]
+        lean.run_stmt(search_ids[0], "0", "intro")
+        lean.clear_search(search_ids[0])
+        lean.clear_search_batch(search_ids[1:])
+        self.assertFalse(lean._states)
+        self.assertFalse(lean._result_cache)
+        self.assertFalse(lean._state_intern)
+        result = lean.run_stmt(search_ids[0], "0", "intro")
+        self.assertEqual(result["error"], "unknown_id")
+
+    def test_cached_results(self):
+        lean = self.make_lean()
+        search_id = lean.init_search("foo")["search_id"]
+        first = lean.run_stmt(search_id, "0", "intro")
+        self.assertIs(lean.run_stmt(search_id, "0", "intro"), first)
+        results = lean.run_batch([search_id] * 2, ["0"] * 2, ["intro"] * 2)
+        self.assertEqual(results, [first] * 2)
+        self.assertEqual(lean.get_tactic_counts(search_id), (0, 1))
+        lean.use_cache = False
+        self.assertIsNot(lean.run_stmt(search_id, "0", "intro"), first)
+
+    def test_cache_by_state(self):
+        lean = self.make_lean(cache_by_state=True)
+        search_id = lean.init_search("foo")["search_id"]
+        same_id = lean.run_stmt(search_id, "0", "skip")["tactic_state_id"]
+        result = lean.run_stmt(search_id, "0", "intro")
+        # Same goals reached by another path
+        self.assertIs(lean.run_stmt(search_id, same_id, "intro"), result)
+        self.assertEqual(lean.get_tactic_counts(search_id), (0, 2))
+
+    def test_quotes_in_commands(self):
+        lean = self.make_lean()
+        decl = 'foo "bar" \\baz'
+        result = lean.init_search(decl)
+        self.assertEqual(result["tactic_state"], "⊢ " + decl)
+        self.assertIsNone(lean.clear_search(result["search_id"])["error"])
+
+    def test_proof_branch(self):
+        lean = self.make_lean()
+        search_id = lean.init_search("foo")["search_id"]
+        lean.run_stmt(search_id, "0", "intro")
+        lean.run_stmt(search_id, "1", "simp")
+        lean.run_stmt(search_id, "0", "exact h")
+        self.assertEqual(
+            lean.get_proof_branch(search_id, "2"), (["intro", "simp"], ["1", "2"])
+        )
+        self.assertEqual(lean.get_proof_branch(search_id, "0"), ([], []))
+
+    def test_killed(self):
+        lean = LeanInstance(LEAN_GYM_PATH)
+        lean.kill()
+        self.assertIsNotNone(lean._proc.returncode)
+        with self.assertRaises(LeanException):
+            lean.init_search("foo")
+
+    def test_init_search_skips_diagnostics(self):
+        lean = self.make_lean()
+        result = lean.init_search("foo")
+        self.assertIsNone(result["error"])
+        self.assertEqual(result["tactic_state"], "⊢ foo")
+        self.assertEqual(lean.get_tactic_state(result["search_id"], "0"), "⊢ foo")
+
+    def test_int_ids(self):
+        lean = self.make_lean()
+        search_id = lean.init_search("foo")["search_id"]
+        first = lean.run_stmt(search_id, "0", "intro")
+        self.assertIs(lean.run_stmt(int(search_id), 0, "intro"), first)
+        self.assertEqual(lean.get_tactic_state(int(search_id), 1), "⊢ foo | intro")
+
+    def test_tactic_counts(self):
+        lean = self.make_lean()
+        search_id = lean.init_search("foo")["search_id"]
+        lean.run_batch([search_id] * 3, ["0"] * 3, ["intro", "fail", "fail 2"])
+        self.assertEqual(lean.get_tactic_counts(search_id), (2, 3))
+        self.assertEqual(lean.get_tactic_counts("unknown"), (0, 0))
+
+    def test_batch_larger_than_pipe(self):
+        lean = self.make_lean(pipe_size=4096)
+        search_id = lean.init_search("foo")["search_id"]
+        tactics = ["tactic_%d %s" % (i, "x" * 100) for i in range(3000)]
+        n = len(tactics)
+        results = lean.run_batch([search_id] * n, ["0"] * n, tactics)
+        self.assertEqual(
+            [result["tactic_state"] for result in results],
+            ["⊢ foo | " + tactic for tactic in tactics],
+        )
+
+    def test_default_pipe_size(self):
+        for pipe_size in (None, 0):
+            lean = self.make_lean(pipe_size=pipe_size)
+            search_id = lean.init_search("foo")["search_id"]
+            self.assertIsNone(lean.run_stmt(search_id, "0", "intro")["error"])
+        with self.assertRaises(ValueError):
+            LeanInstance(LEAN_GYM_PATH, pipe_size=-1)
+
+    def test_quotes_and_backslashes_in_tactics(self):
+        lean = self.make_lean()
+        search_id = lean.init_search("foo")["search_id"]
+        tactics = ['simp ["a", b] at h ⊢', "rw \\foo", 'exact "\\"\n\t', "{ }"]
+        n = len(tactics)
+        results = lean.run_batch([search_id] * n, ["0"] * n, tactics)
+        for tactic, result in zip(tactics, results):
+            self.assertEqual(result["tactic_state"], "⊢ foo | " + tactic)
+        result = lean.run_stmt(search_id, "0", tactics[0] + "!")
+        self.assertEqual(result["tactic_state"], "⊢ foo | " + tactics[0] + "!")
+
+    def test_timeout_then_next_reply(self):
+        lean = self.make_lean(timeout=0.2)
+        search_id = lean.init_search("foo")["search_id"]
+        with self.assertRaises(LeanTimeoutError):
+            lean.run_stmt(search_id, "0", "sleep 0.5")
+        lean.timeout = 10
+        # The late reply to "sleep" must not be taken for this one
+        result = lean.run_stmt(search_id, "0", "intro")
+        self.assertEqual(result["tactic_state"], "⊢ foo | intro")
+        result = lean.run_stmt(search_id, "0", "exact h")
+        self.assertEqual(result["tactic_state"], "⊢ foo | exact h")
+
+    def test_zero_timeout_polls_once(self):
+        lean = self.make_lean()
+        with self.assertRaises(LeanTimeoutError):
+            lean.get_result(timeout=0)
+
+    def test_reply_larger_than_read(self):
+        lean = self.make_lean()
+        search_id = lean.init_search("foo")["search_id"]
+        tactic = "x" * 300000
+        result = lean.run_stmt(search_id, "0", tactic)
+        self.assertEqual(result["tactic_state"], "⊢ foo | " + tactic)
+
+    def test_max_live_searches(self):
+        lean = self.make_lean(max_live_searches=2)
+        search_ids = [lean.init_search(decl)["search_id"] for decl in "abc"]
+        self.assertEqual(list(lean._states), search_ids[1:])
+        with self.assertRaises(ValueError):
+            lean.init_search_batch(["d", "e", "f"])
+        new_ids = [r["search_id"] for r in lean.init_search_batch(["d", "e"])]
+        self.assertEqual(list(lean._states), new_ids)
+        for search_id in new_ids:
+            self.assertIsNone(lean.run_stmt(search_id, "0", "intro")["error"])
+
+    def test_errors_are_not_cached(self):
+        lean = self.make_lean()
+        search_id = lean.init_search("foo")["search_id"]
+        self.assertEqual(lean.run_stmt(search_id, "1", "a")["error"], "unknown_id")
+        lean.run_stmt(search_id, "0", "b")
+        result = lean.run_stmt(search_id, "1", "a")
+        self.assertEqual(result["tactic_state"], "⊢ foo | b | a")
+
+    def test_shared_goals_survive_clear(self):
+        lean = self.make_lean(cache_by_state=True)
+        first, second = [r["search_id"] for r in lean.init_search_batch(["a", "a"])]
+        for search_id in (first, second):
+            lean.run_stmt(search_id, "0", "intro")
+        shared = lean.get_tactic_state(second, "1")
+        self.assertIs(lean.get_tactic_state(first, "1"), shared)
+        lean.clear_search(first)
+        self.assertEqual(lean._state_refs, {"⊢ a": 1, "⊢ a | intro": 1})
+        result = lean.run_stmt(second, "1", "simp")
+        self.assertIs(lean._state_intern[shared], shared)
+        self.assertEqual(result["tactic_state"], "⊢ a | intro | simp")
+        lean.clear_search(second)
+        self.assertFalse(lean._state_refs)
+        self.assertFalse(lean._state_intern)
+        self.assertFalse(lean._state_digests)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+
+from pylean import LeanException, LeanPool
+
+from . import LEAN_GYM_PATH
+
+
+class LeanPoolTest(unittest.TestCase):
+    def make_pool(self, **kwargs):
+        pool = LeanPool(LEAN_GYM_PATH, n_workers=2, timeout=10, **kwargs)
+        self.addCleanup(pool.kill)
+        return pool
+
+    def test_pool_ids(self):
+        pool = self.make_pool()
+        results = [pool.init_search(decl) for decl in "abc"]
+        search_ids = [result["search_id"] for result in results]
+        # lean-gym numbers searches per process, the pool ids are unique
+        self.assertEqual(len(set(search_ids)), 3)
+        self.assertEqual(sorted(pool._n_searches), [1, 2])
+
+        results = pool.run_batch(search_ids, ["0"] * 3, ["intro"] * 3)
+        self.assertEqual(
+            [result["tactic_state"] for result in results],
+            ["⊢ a | intro", "⊢ b | intro", "⊢ c | intro"],
+        )
+        self.assertEqual([result["search_id"] for result in results], search_ids)
+        result = pool.run_stmt(search_ids[2], "1", "fail")
+        self.assertIsNotNone(result["error"])
+
+        pool.clear_search(search_ids[0])
+        self.assertEqual(sum(pool._n_searches), 2)
+        result = pool.run_stmt(search_ids[1], "0", "exact h")
+        self.assertEqual(result["search_id"], search_ids[1])
+
+    def test_failed_init_keeps_counts(self):
+        pool = self.make_pool()
+
+        def fail(*args):
+            raise LeanException("dead")
+
+        pool.workers[1].init_search = fail
+        pool.init_search("a")
+        with self.assertRaises(LeanException):
+            pool.init_search("b")
+        self.assertEqual(pool._n_searches, [1, 0])
+
+    def test_init_search_batch(self):
+        pool = self.make_pool()
+        results = pool.init_search_batch(["d%d" % i for i in range(5)])
+        self.assertEqual(
+            [result["tactic_state"] for result in results],
+            ["⊢ d%d" % i for i in range(5)],
+        )
+        self.assertEqual(len({result["search_id"] for result in results}), 5)
+        self.assertEqual(sorted(pool._n_searches), [2, 3])
+
+    def test_failed_init_batch_keeps_counts(self):
+        pool = self.make_pool()
+
+        def fail(*args):
+            raise LeanException("dead")
+
+        pool.workers[1].init_search_batch = fail
+        with self.assertRaises(LeanException):
+            pool.init_search_batch(["a", "b", "c", "d"])
+        # Searches made by the healthy process are cleared, not orphaned
+        self.assertEqual(pool._n_searches, [0, 0])
+        self.assertFalse(pool._searches)
+        self.assertFalse(pool.workers[0]._states)
+
+    def test_max_live_searches_rejected(self):
+        with self.assertRaises(TypeError):
+            LeanPool(LEAN_GYM_PATH, n_workers=1, max_live_searches=1)
+
+
+if __name__ == "__main__":
+    unittest.main()